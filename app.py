@@ -1,14 +1,24 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
-import plotly.graph_objs as go
 import datetime
+import hashlib
+import numpy as np
+import os
+import tempfile
+import time
+from contextlib import suppress
+from pathlib import Path
 
 # --- הגדרות ראשיות ---
 st.set_page_config(page_title="Stocks & ETFs Comparator", page_icon="📊", layout="wide")
 st.title("📈 Stocks, Indices & ETFs Comparator")
 
 DEFAULT_INVESTMENT = 100
+MAX_POINTS_PER_TRACE = 1000
+CACHE_DIR = Path(__file__).parent / ".cache"
+CACHE_TTL_SECONDS = 24 * 60 * 60
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close"]
 
 # --- Sidebar ---
 st.sidebar.header("Options")
@@ -32,53 +42,137 @@ end_date = f"{years_range[1]}-12-31"
 investment = st.sidebar.number_input("Initial investment ($)", min_value=10, value=DEFAULT_INVESTMENT, step=10)
 
 # --- Helper functions ---
+def downcast(df):
+    return df.astype({c: "float32" for c in PRICE_COLUMNS if c in df.columns})
+
+def cache_path(ticker, start, end):
+    return CACHE_DIR / f"{ticker.replace('/', '_')}_{start}_{end}_adj.parquet"
+
+def read_cache(path):
+    # Yahoo מתקן היסטוריה מותאמת אחרי כל דיבידנד/פיצול, לכן קובץ ישן נחשב חסר
+    try:
+        if time.time() - path.stat().st_mtime > CACHE_TTL_SECONDS:
+            return None
+        return pd.read_parquet(path)
+    except (OSError, ValueError):
+        # קובץ חסר או פגום - נוריד מחדש
+        return None
+
+def write_cache(df, path):
+    # כתיבה לקובץ זמני והחלפה אטומית, כדי שסשן אחר לא יקרא קובץ חלקי
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+    except OSError:
+        return
+    try:
+        df.to_parquet(tmp, compression="snappy")
+        os.replace(tmp, path)
+    except OSError:
+        # המטמון הוא רק האצה - אם הכתיבה נכשלה ממשיכים עם הנתונים שבזיכרון
+        pass
+    finally:
+        with suppress(OSError):
+            os.remove(tmp)
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def get_data_multi(tickers, start, end):
+    frames = {}
+    missing = []
+    for t in tickers:
+        df = read_cache(cache_path(t, start, end))
+        if df is not None:
+            frames[t] = df
+        else:
+            missing.append(t)
+
+    if missing:
+        raw = yf.download(missing, start=start, end=end, group_by="ticker", threads=True,
+                          auto_adjust=True, progress=False)
+        if not isinstance(raw.columns, pd.MultiIndex):
+            raw = pd.concat({missing[0]: raw}, axis=1)
+        # טווח שעדיין לא הסתיים ימשיך להתעדכן, לכן לא נשמר לדיסק
+        persist = end < datetime.date.today().isoformat()
+        for t in raw.columns.get_level_values(0).unique():
+            df = downcast(raw[t].dropna(how="all"))
+            frames[t] = df
+            if persist and not df.empty:
+                write_cache(df, cache_path(t, start, end))
+
+    # טיקרים עם טווחי תאריכים שונים - יש למיין את האינדקס המאוחד במפורש
+    return pd.concat(frames, axis=1).sort_index() if frames else pd.DataFrame()
+
+def frame_digest(frame):
+    h = hashlib.sha1("|".join(frame.columns).encode())
+    h.update(frame.index.asi8.tobytes())
+    h.update(frame.to_numpy().tobytes())
+    return h.hexdigest()
+
+# התוצאה נשמרת במטמון לפי תקציר הנתונים (key), כמו הגרפים
 @st.cache_data
-def get_stock_data(ticker, start, end):
-    return yf.download(ticker, start=start, end=end, progress=False)
-
-def calc_return(df, investment):
-    if df.empty:
-        return None, None
-    start_price = float(df["Close"].iloc[0])
-    end_price = float(df["Close"].iloc[-1])
-    ret = (end_price - start_price) / start_price * 100
-    final_value = (end_price / start_price) * investment
-    return round(ret, 2), round(final_value, 2)
+def calc_returns(key, _closes, _first, investment):
+    # האחסון ב-float32, אבל החישוב ב-float64 כדי שתשואות גבוהות יישארו מדויקות
+    growth = _closes.ffill().iloc[-1].astype("float64") / _first.astype("float64")
+    return pd.DataFrame({
+        "Ticker": _closes.columns,
+        "Return %": ((growth - 1) * 100).round(2).values,
+        f"Value of ${investment}": (growth * investment).round(2).values,
+    }).sort_values(by="Return %", ascending=False, ignore_index=True)
+
+def downsample(series, n_out=MAX_POINTS_PER_TRACE):
+    from tsdownsample import MinMaxLTTBDownsampler
+
+    series = series.dropna()
+    x, y = series.index, series.to_numpy()
+    if len(series) <= n_out:
+        return x, y
+    # עמודה מתוך טבלה רחבה יכולה להיות מערך לא רציף, ו-tsdownsample דורש מערכים רציפים
+    idx = MinMaxLTTBDownsampler().downsample(np.ascontiguousarray(x.asi8), np.ascontiguousarray(y), n_out=n_out)
+    return x[idx], y[idx]
+
+# הגרף נשמר במטמון לפי תקציר הנתונים, כך שריצה חוזרת עם אותם נתונים לא בונה אותו מחדש
+@st.cache_resource(max_entries=32)
+def line_chart(key, _frame, title, yaxis_title):
+    import plotly.graph_objs as go
+
+    traces = []
+    for t in _frame.columns:
+        x, y = downsample(_frame[t])
+        traces.append(go.Scattergl(x=x, y=y, mode="lines", name=t))
+    fig = go.Figure(data=traces)
+    fig.update_layout(title=title, xaxis_title="Date", yaxis_title=yaxis_title, hovermode="x unified")
+    return fig
 
 # --- Main ---
-all_data = {}
-results = []
-
-for t in tickers:
-    df = get_stock_data(t, start_date, end_date)
-    if not df.empty:
-        all_data[t] = df
-        ret, val = calc_return(df, investment)
-        results.append({"Ticker": t, "Return %": ret, f"Value of ${investment}": val})
+raw = get_data_multi(tuple(tickers), start_date, end_date) if tickers else pd.DataFrame()
+# מחירי סגירה לכל הטיקרים (שורות = תאריכים, עמודות = טיקרים)
+closes = raw.xs("Close", axis=1, level=1) if not raw.empty else pd.DataFrame()
+
+valid_tickers = []
+for t in dict.fromkeys(tickers):
+    if t in closes.columns and closes[t].notna().any():
+        valid_tickers.append(t)
     else:
         st.warning(f"No data for {t}")
 
-if all_data:
+if valid_tickers:
+    closes = closes[valid_tickers]
+    closes_key = frame_digest(closes)
+    first = closes.bfill().iloc[0]
+
     # --- גרף מחירים ---
     st.subheader("Stock/ETF Prices")
-    fig = go.Figure()
-    for t, df in all_data.items():
-        fig.add_trace(go.Scatter(x=df.index, y=df["Close"], mode="lines", name=t))
-    fig.update_layout(title="Closing Prices", xaxis_title="Date", yaxis_title="Price (USD)", hovermode="x unified")
+    fig = line_chart(closes_key, closes, "Closing Prices", "Price (USD)")
     st.plotly_chart(fig, use_container_width=True)
 
     # --- גרף מנורמל ---
     st.subheader("Normalized Prices (Base = 100)")
-    fig_norm = go.Figure()
-    for t, df in all_data.items():
-        norm = df["Close"] / df["Close"].iloc[0] * 100
-        fig_norm.add_trace(go.Scatter(x=df.index, y=norm, mode="lines", name=t))
-    fig_norm.update_layout(title="Normalized Price Comparison", xaxis_title="Date", yaxis_title="Index (Base 100)",
-                           hovermode="x unified")
+    normalized = closes.divide(first, axis=1).mul(100)
+    fig_norm = line_chart(frame_digest(normalized), normalized, "Normalized Price Comparison", "Index (Base 100)")
     st.plotly_chart(fig_norm, use_container_width=True)
 
     # --- טבלה ---
-    if results:
-        df_results = pd.DataFrame(results).sort_values(by="Return %", ascending=False, ignore_index=True)
-        st.subheader("🏆 Performance Table")
-        st.dataframe(df_results)
+    df_results = calc_returns(closes_key, closes, first, investment)
+    st.subheader("🏆 Performance Table")
+    st.dataframe(df_results)